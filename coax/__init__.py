@@ -35,7 +35,7 @@ from ._core.stochastic_reward_function import StochasticRewardFunction
 from ._core.value_based_policy import EpsilonGreedy, BoltzmannPolicy
 from ._core.random_policy import RandomPolicy
 from ._core.successor_state_q import SuccessorStateQ
-from .utils import safe_sample, render_episode
+from .utils import safe_sample, render_episode, configure_memory
 
 # pre-load submodules
 from . import experience_replay
@@ -69,6 +69,7 @@ __all__ = (
     'SuccessorStateQ',
     'safe_sample',
     'render_episode',
+    'configure_memory',
 
     # modules
     'experience_replay',
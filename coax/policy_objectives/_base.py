@@ -27,7 +27,9 @@ import optax
 import haiku as hk
 
 from .._core.policy import Policy
-from ..utils import get_grads_diagnostics, jit
+from ..reward_tracing import TransitionBatch
+from ..utils import (
+    get_grads_diagnostics, jit, pmap, pmean_grads_and_metrics, shard_batch, unreplicate)
 from ..regularizers import Regularizer
 
 
@@ -58,6 +60,7 @@ class PolicyObjective:
 
         self._pi = pi
         self._regularizer = regularizer
+        self._hyperparams = self._reg_hparams = None  # see hyperparams property
 
         # optimizer
         self._optimizer = optax.adam(1e-3) if optimizer is None else optimizer
@@ -70,12 +73,12 @@ class PolicyObjective:
             # flip sign to turn objective into loss
             loss = -objective
 
-            # keep track of performance metrics
+            # keep track of performance metrics (metrics aren't differentiated, hence stop_gradient)
+            log_pi_old, log_pi_new = jax.lax.stop_gradient((transition_batch.logP, log_pi))
             metrics = {
-                f'{self.__class__.__name__}/loss': loss,
                 f'{self.__class__.__name__}/loss_bare': loss,
-                f'{self.__class__.__name__}/kl_div_old':
-                    jnp.mean(jnp.exp(transition_batch.logP) * (transition_batch.logP - log_pi)),
+                # sample estimate of KL(pi_old || pi), given that A ~ pi_old (no need for exp(logP))
+                f'{self.__class__.__name__}/kl_div_old': jnp.mean(log_pi_old - log_pi_new),
             }
 
             # add regularization term
@@ -83,29 +86,43 @@ class PolicyObjective:
                 hparams = hyperparams['regularizer']
                 W = jnp.clip(transition_batch.W, 0.1, 10.)  # clip imp. weights to reduce variance
                 loss = loss + jnp.mean(W * self.regularizer.function(dist_params, **hparams))
-                metrics[f'{self.__class__.__name__}/loss'] = loss
                 metrics.update(self.regularizer.metrics_func(dist_params, **hparams))
 
             # also pass auxiliary data to avoid multiple forward passes
             return loss, (metrics, state_new)
 
         def grads_and_metrics_func(params, state, hyperparams, rng, transition_batch, Adv):
-            grads_func = jax.grad(loss_func, has_aux=True)
-            grads, (metrics, state_new) = \
+            grads_func = jax.value_and_grad(loss_func, has_aux=True)
+            (loss, (metrics, state_new)), grads = \
                 grads_func(params, state, hyperparams, rng, transition_batch, Adv)
+            metrics = {f'{self.__class__.__name__}/loss': loss, **metrics}
 
             # add some diagnostics of the gradients
-            metrics.update(get_grads_diagnostics(grads, f'{self.__class__.__name__}/grads_'))
+            metrics.update(get_grads_diagnostics(
+                jax.lax.stop_gradient(grads), f'{self.__class__.__name__}/grads_'))
 
             return grads, state_new, metrics
 
+        def grads_and_metrics_pmap_func(params, state, hyperparams, rng, transition_batch, Adv):
+            # looked up at trace time, so that we pick up the current version of this function
+            grads_and_metrics_func = self._grad_and_metrics_func.func
+            rng = jax.random.fold_in(rng, jax.lax.axis_index('devices'))  # decorrelate devices
+            grads, state_new, metrics = \
+                grads_and_metrics_func(params, state, hyperparams, rng, transition_batch, Adv)
+            return pmean_grads_and_metrics(
+                grads, state_new, metrics, 'devices', f'{self.__class__.__name__}/grads_')
+
         def apply_grads_func(opt, opt_state, params, grads):
             updates, new_opt_state = opt.update(grads, opt_state, params)
             new_params = optax.apply_updates(params, updates)
             return new_opt_state, new_params
 
         self._grad_and_metrics_func = jit(grads_and_metrics_func)
-        self._apply_grads_func = jit(apply_grads_func, static_argnums=0)
+        self._grads_and_metrics_pmap_func = pmap(
+            grads_and_metrics_pmap_func, axis_name='devices',
+            in_axes=(None, None, None, None, 0, 0))
+        # donate opt_state; we can't donate params, because params are shared with shallow copies
+        self._apply_grads_func = jit(apply_grads_func, static_argnums=0, donate_argnums=1)
 
     @property
     def pi(self):
@@ -136,8 +153,14 @@ class PolicyObjective:
 
     @property
     def hyperparams(self):
-        return hk.data_structures.to_immutable_dict({
-            'regularizer': getattr(self.regularizer, 'hyperparams', {})})
+        # the regularizer hands out the same dict until one of its hyperparams is reassigned, which
+        # means that an identity check suffices to tell whether our cached copy is stale
+        reg_hparams = getattr(self.regularizer, 'hyperparams', None)
+        if self._hyperparams is None or reg_hparams is not self._reg_hparams:
+            self._reg_hparams = reg_hparams
+            self._hyperparams = hk.data_structures.to_immutable_dict({
+                'regularizer': {} if reg_hparams is None else reg_hparams})
+        return self._hyperparams
 
     def update(self, transition_batch, Adv):
         r"""
@@ -167,6 +190,76 @@ class PolicyObjective:
         self.update_from_grads(grads, function_state)
         return metrics
 
+    def compile(self, transition_batch, Adv):
+        r"""
+
+        Compile the update functions ahead of time for inputs of the given shapes and dtypes.
+
+        By default, the update functions are compiled upon first use, which blocks the first call
+        to :attr:`update`. This method can be used to shift the compilation cost to a moment of
+        choosing, e.g. right after construction. Nothing is executed, and none of the model
+        parameters or the optimizer state is changed. Note that changing an input shape (e.g. the
+        batch size) or one of the static settings (e.g. :attr:`PPOClip.epsilon
+        <coax.policy_objectives.PPOClip.epsilon>`) triggers a recompilation.
+
+        Parameters
+        ----------
+        transition_batch : TransitionBatch
+
+            A representative batch of transitions.
+
+        Adv : ndarray
+
+            A representative batch of advantages.
+
+        """
+        rng = jax.random.PRNGKey(0)  # only the shape and dtype matter
+        self._grad_and_metrics_func.lower(
+            self._pi.params, self._pi.function_state, self.hyperparams, rng,
+            self._slim_transition_batch(transition_batch), Adv).compile()
+        grads = jax.tree_map(jnp.zeros_like, self._pi.params)
+        self._apply_grads_func.lower(
+            self.optimizer, self.optimizer_state, self._pi.params, grads).compile()
+
+    def update_data_parallel(self, transition_batch, Adv):
+        r"""
+
+        Update the model parameters (weights) of the underlying function approximator, where the
+        computation of the gradients is distributed over all local devices.
+
+        The batch is split into :code:`jax.local_device_count()` equal shards. Each device computes
+        the gradients for its own shard, after which the gradients, function state and metrics are
+        averaged over devices. The model parameters are broadcast to all devices.
+
+        Parameters
+        ----------
+        transition_batch : TransitionBatch
+
+            A batch of transitions. The batch size must be divisible by the number of devices.
+
+        Adv : ndarray
+
+            A batch of advantages :math:`\mathcal{A}(s,a)=q(s,a)-v(s)`.
+
+        Returns
+        -------
+        metrics : dict of scalar ndarrays
+
+            The structure of the metrics dict is ``{name: score}``.
+
+        """
+        self._check_propensities(transition_batch)
+        num_devices = jax.local_device_count()
+        grads, function_state, metrics = self._grads_and_metrics_pmap_func(
+            self._pi.params, self._pi.function_state, self.hyperparams, self._pi.rng,
+            shard_batch(self._slim_transition_batch(transition_batch), num_devices),
+            shard_batch(Adv, num_devices))
+        grads, function_state, metrics = unreplicate((grads, function_state, metrics))
+        if any(jnp.any(jnp.isnan(g)) for g in jax.tree_leaves(grads)):
+            raise RuntimeError(f"found nan's in grads: {grads}")
+        self.update_from_grads(grads, function_state)
+        return metrics
+
     def update_from_grads(self, grads, function_state):
         r"""
 
@@ -224,12 +317,21 @@ class PolicyObjective:
             The structure of the metrics dict is ``{name: score}``.
 
         """
+        self._check_propensities(transition_batch)
+        return self._grad_and_metrics_func(
+            self._pi.params, self._pi.function_state, self.hyperparams, self._pi.rng,
+            self._slim_transition_batch(transition_batch), Adv)
+
+    def _slim_transition_batch(self, transition_batch):
+        # policy objectives don't use the bootstrapping fields, so we don't transfer them to device
+        return TransitionBatch(
+            S=transition_batch.S, A=transition_batch.A, logP=transition_batch.logP,
+            Rn=None, In=None, S_next=None, W=transition_batch.W, idx=transition_batch.idx)
+
+    def _check_propensities(self, transition_batch):
         if self.REQUIRES_PROPENSITIES and jnp.all(transition_batch.logP == 0):
             warnings.warn(
                 f"In order for {self.__class__.__name__} to work properly, transition_batch.logP "
                 "should be non-zero. Please sample actions with their propensities: "
                 "a, logp = pi(s, return_logp=True) and then add logp to your reward tracer, "
                 "e.g. nstep_tracer.add(s, a, r, done, logp)")
-        return self._grad_and_metrics_func(
-            self._pi.params, self._pi.function_state, self.hyperparams, self._pi.rng,
-            transition_batch, Adv)
@@ -19,10 +19,12 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.          #
 # ------------------------------------------------------------------------------------------------ #
 
+import jax
 import jax.numpy as jnp
-import haiku as hk
+import numpy as onp
 import chex
 
+from ..utils import jit, rejit
 from ._base import PolicyObjective
 
 
@@ -76,34 +78,147 @@ class PPOClip(PolicyObjective):
 
     def __init__(self, pi, optimizer=None, regularizer=None, epsilon=0.2):
         super().__init__(pi=pi, optimizer=optimizer, regularizer=regularizer)
+
+        def update_epochs_func(
+                opt, num_epochs, num_minibatches,
+                opt_state, params, state, hyperparams, rng, transition_batch, Adv):
+
+            # these are looked up at trace time, i.e. they pick up the current value of epsilon
+            grads_and_metrics_func = self._grad_and_metrics_func.func
+            apply_grads_func = self._apply_grads_func.func
+
+            # reshuffle the transitions for each epoch (the remainder of each epoch is dropped)
+            batch_size = Adv.shape[0]  # the slimmed transition_batch doesn't carry Rn
+            minibatch_size = batch_size // num_minibatches
+            rng_perm, rng = jax.random.split(rng)
+
+            def get_epoch_indices(rng):
+                idx = jax.random.permutation(rng, batch_size)[:num_minibatches * minibatch_size]
+                return idx.reshape(num_minibatches, minibatch_size)
+
+            indices = jax.vmap(get_epoch_indices)(jax.random.split(rng_perm, num_epochs))
+            indices = indices.reshape(num_epochs * num_minibatches, minibatch_size)
+            rngs = jax.random.split(rng, num_epochs * num_minibatches)
+
+            def minibatch_update(carry, inputs):
+                opt_state, params, state = carry
+                idx, rng = inputs
+                minibatch = jax.tree_map(lambda leaf: leaf[idx], transition_batch)
+                grads, state, metrics = \
+                    grads_and_metrics_func(params, state, hyperparams, rng, minibatch, Adv[idx])
+                opt_state, params = apply_grads_func(opt, opt_state, params, grads)
+                return (opt_state, params, state), metrics
+
+            (opt_state, params, state), metrics = jax.lax.scan(
+                minibatch_update, (opt_state, params, state), (indices, rngs))
+
+            # average the metrics over all minibatch updates
+            metrics = jax.tree_map(jnp.mean, metrics)
+            return opt_state, params, state, metrics
+
+        # don't donate opt_state, so that it stays intact if we need to raise on nan's (see below)
+        self._update_epochs_func = jit(update_epochs_func, static_argnums=(0, 1, 2))
         self.epsilon = epsilon
 
     @property
-    def hyperparams(self):
-        return hk.data_structures.to_immutable_dict({
-            'regularizer': getattr(self.regularizer, 'hyperparams', {}),
-            'epsilon': self.epsilon})
+    def epsilon(self):
+        return self._epsilon
+
+    @epsilon.setter
+    def epsilon(self, new_epsilon):
+        # epsilon is baked into the compiled graph as a constant, so we need to re-jit
+        self._epsilon = float(new_epsilon)
+        for name in (
+                '_grad_and_metrics_func', '_grads_and_metrics_pmap_func', '_update_epochs_func'):
+            setattr(self, name, rejit(getattr(self, name)))
 
     def objective_func(self, params, state, hyperparams, rng, transition_batch, Adv):
-        rngs = hk.PRNGSequence(rng)
+        rng_s, rng_pi, rng_a = jax.random.split(rng, 3)
+        lo, hi = 1 - self.epsilon, 1 + self.epsilon  # python floats, i.e. static
 
         # get distribution params from function approximator
-        S = self.pi.observation_preprocessor(next(rngs), transition_batch.S)
-        dist_params, state_new = self.pi.function(params, state, next(rngs), S, True)
+        S = self.pi.observation_preprocessor(rng_s, transition_batch.S)
+        dist_params, state_new = self.pi.function(params, state, rng_pi, S, True)
 
         # compute probability ratios
-        A = self.pi.proba_dist.preprocess_variate(next(rngs), transition_batch.A)
+        # the preprocessed actions don't depend on params, so keep them out of the backward graph
+        A = self.pi.proba_dist.preprocess_variate(rng_a, transition_batch.A)
+        A = jax.lax.stop_gradient(A)
         log_pi = self.pi.proba_dist.log_proba(dist_params, A)
         ratio = jnp.exp(log_pi - transition_batch.logP)  # π_new / π_old
-        ratio_clip = jnp.clip(ratio, 1 - hyperparams['epsilon'], 1 + hyperparams['epsilon'])
 
         # clip importance weights to reduce variance
         W = jnp.clip(transition_batch.W, 0.1, 10.)
 
-        # ppo-clip objective
-        chex.assert_equal_shape([W, Adv, ratio, ratio_clip])
-        chex.assert_rank([W, Adv, ratio, ratio_clip], 1)
-        objective = W * jnp.minimum(Adv * ratio, Adv * ratio_clip)
+        # ppo-clip objective: min(Adv * ratio, Adv * ratio_clip) only picks the clipped term if the
+        # ratio exceeds the trust region in the direction in which Adv pushes it
+        chex.assert_equal_shape([W, Adv, ratio])
+        chex.assert_rank([W, Adv, ratio], 1)
+        use_clip = ((ratio > hi) & (Adv > 0)) | ((ratio < lo) & (Adv < 0))
+        objective = W * Adv * jnp.where(use_clip, jnp.clip(ratio, lo, hi), ratio)
 
         # also pass auxiliary data to avoid multiple forward passes
         return jnp.mean(objective), (dist_params, log_pi, state_new)
+
+    def update_epochs(self, transition_batch, Adv, num_epochs=4, num_minibatches=4):
+        r"""
+
+        Update the model parameters (weights) by running multiple epochs of minibatch updates over
+        the same batch of transitions.
+
+        This is the typical way to use PPO: collect a large batch of transitions and then do a few
+        passes of minibatch updates over it. The entire loop runs inside a single JIT-compiled
+        function, which avoids a round trip between host and device for each minibatch update.
+
+        Parameters
+        ----------
+        transition_batch : TransitionBatch
+
+            A batch of transitions.
+
+        Adv : ndarray
+
+            A batch of advantages :math:`\mathcal{A}(s,a)=q(s,a)-v(s)`.
+
+        num_epochs : positive int, optional
+
+            The number of passes over the batch of transitions.
+
+        num_minibatches : positive int, optional
+
+            The number of minibatches into which the batch of transitions is split for each epoch.
+            The transitions are reshuffled for each epoch. If the batch size isn't divisible by
+            :code:`num_minibatches`, the remaining transitions are left out for that epoch.
+
+        Returns
+        -------
+        metrics : dict of scalar ndarrays
+
+            The structure of the metrics dict is ``{name: score}``. The scores are averaged over all
+            minibatch updates.
+
+        """
+        if not (isinstance(num_epochs, int) and num_epochs > 0):
+            raise ValueError(f"num_epochs must be a positive int, got: {num_epochs}")
+        batch_size = transition_batch.batch_size
+        if onp.shape(Adv) != (batch_size,):
+            raise ValueError(
+                f"Adv must have shape ({batch_size},) to match the batch size, got: "
+                f"{onp.shape(Adv)}")
+        if not (isinstance(num_minibatches, int) and 0 < num_minibatches <= batch_size):
+            raise ValueError(
+                "num_minibatches must be a positive int that doesn't exceed the batch size, got: "
+                f"{num_minibatches}")
+
+        self._check_propensities(transition_batch)
+        optimizer_state, params, function_state, metrics = self._update_epochs_func(
+            self.optimizer, num_epochs, num_minibatches, self.optimizer_state,
+            self._pi.params, self._pi.function_state, self.hyperparams, self._pi.rng,
+            self._slim_transition_batch(transition_batch), Adv)
+
+        # the grads norm is averaged over all minibatch updates, so any nan's propagate into it
+        if jnp.isnan(metrics[f'{self.__class__.__name__}/grads_norm']):
+            raise RuntimeError(f"found nan's in grads during update_epochs; metrics: {metrics}")
+        self.optimizer_state, self._pi.params, self._pi.function_state = \
+            optimizer_state, params, function_state
+        return metrics
@@ -21,12 +21,14 @@
 
 from copy import deepcopy
 
+import jax
 import jax.numpy as jnp
+import haiku as hk
 from optax import sgd
 
 from .._base.test_case import TestCase
 from .._core.policy import Policy
-from ..utils import tree_ravel
+from ..utils import get_transition_batch, tree_ravel
 from ._ppo_clip import PPOClip
 
 
@@ -71,3 +73,137 @@ class TestPPOClip(TestCase):
 
         self.assertPytreeNotEqual(function_state, pi.function_state)
         self.assertPytreeNotEqual(params, pi.params)
+
+    def test_epsilon_setter(self):
+        env = self.env_discrete
+        func = self.func_pi_discrete
+        transitions = self.transitions_discrete
+
+        pi = Policy(func, env)
+        updater = PPOClip(pi, optimizer=sgd(1.0), epsilon=1e6)
+        grads_unclipped, _, _ = updater.grads_and_metrics(transitions, Adv=transitions.Rn)
+
+        updater.epsilon = 1e-6
+        self.assertEqual(updater.epsilon, 1e-6)
+        grads_clipped, _, _ = updater.grads_and_metrics(transitions, Adv=transitions.Rn)
+
+        self.assertPytreeNotEqual(grads_unclipped, grads_clipped)
+
+    def test_objective_matches_min_form(self):
+        env = self.env_discrete
+        func = self.func_pi_discrete
+        transitions = deepcopy(self.transitions_discrete)
+
+        pi = Policy(func, env)
+        updater = PPOClip(pi, epsilon=0.2)
+
+        # spread out the ratios and advantages over both sides of the trust region
+        rngs = jax.random.split(pi.rng)
+        transitions.logP = jax.random.uniform(rngs[0], transitions.Rn.shape, minval=-3., maxval=0.)
+        Adv = jax.random.normal(rngs[1], transitions.Rn.shape)
+
+        objective, (_, log_pi, _) = updater.objective_func(
+            pi.params, pi.function_state, updater.hyperparams, pi.rng, transitions, Adv)
+        ratio = jnp.exp(log_pi - transitions.logP)
+        expected = jnp.mean(jnp.minimum(Adv * ratio, Adv * jnp.clip(ratio, 0.8, 1.2)))
+        self.assertAlmostEqual(objective, expected, decimal=5)
+
+    def test_slim_transition_batch(self):
+        pi = Policy(self.func_pi_discrete, self.env_discrete)
+        updater = PPOClip(pi)
+        transitions = self.transitions_discrete
+
+        transitions_slim = updater._slim_transition_batch(transitions)
+        for name in ('Rn', 'In', 'S_next', 'A_next', 'logP_next'):
+            self.assertIsNone(getattr(transitions_slim, name))
+        self.assertArrayAlmostEqual(transitions_slim.logP, transitions.logP)
+
+    def test_compile(self):
+        pi = Policy(self.func_pi_discrete, self.env_discrete)
+        updater = PPOClip(pi, optimizer=sgd(1.0))
+        transitions = self.transitions_discrete
+
+        params = deepcopy(pi.params)
+        updater.compile(transitions, Adv=transitions.Rn)
+        self.assertPytreeAlmostEqual(params, pi.params)
+
+        updater.update(transitions, Adv=transitions.Rn)
+        self.assertPytreeNotEqual(params, pi.params)
+
+    def test_update_data_parallel(self):
+        env = self.env_discrete
+
+        def func(S, is_training):
+            # no batch norm, so that the shards see the same function as the full batch
+            seq = hk.Sequential((
+                hk.Flatten(), hk.Linear(7), jnp.tanh, hk.Linear(env.action_space.n)))
+            return {'logits': seq(S)}
+
+        # batch size must be divisible by jax.local_device_count()
+        transitions = get_transition_batch(env, batch_size=8, random_seed=13)
+
+        pi = Policy(func, env)
+        updater = PPOClip(pi, optimizer=sgd(1.0))
+
+        params = deepcopy(pi.params)
+        grads, _, metrics_expected = updater.grads_and_metrics(transitions, Adv=transitions.Rn)
+
+        metrics = updater.update_data_parallel(transitions, Adv=transitions.Rn)
+        self.assertEqual(metrics['PPOClip/loss'].shape, ())
+        self.assertPytreeNotEqual(params, pi.params)
+
+        # sgd(1.0) means that the params are shifted by exactly -grads
+        params_expected = jax.tree_map(lambda p, g: p - g, params, grads)
+        self.assertPytreeAlmostEqual(params_expected, pi.params, decimal=5)
+        self.assertPytreeAlmostEqual(metrics, metrics_expected, decimal=5)
+
+    def test_update_epochs(self):
+        env = self.env_discrete
+        func = self.func_pi_discrete
+        transitions = self.transitions_discrete
+
+        pi = Policy(func, env)
+        updater = PPOClip(pi, optimizer=sgd(1.0))
+
+        params = deepcopy(pi.params)
+        function_state = deepcopy(pi.function_state)
+
+        metrics = updater.update_epochs(
+            transitions, Adv=transitions.Rn, num_epochs=2, num_minibatches=2)
+        self.assertIn('PPOClip/loss', metrics)
+        self.assertEqual(metrics['PPOClip/loss'].shape, ())
+
+        self.assertPytreeNotEqual(function_state, pi.function_state)
+        self.assertPytreeNotEqual(params, pi.params)
+
+    def test_update_epochs_bad_num_minibatches(self):
+        pi = Policy(self.func_pi_discrete, self.env_discrete)
+        updater = PPOClip(pi)
+        transitions = self.transitions_discrete
+
+        msg = r"num_minibatches must be a positive int that doesn't exceed the batch size"
+        with self.assertRaisesRegex(ValueError, msg):
+            updater.update_epochs(
+                transitions, Adv=transitions.Rn, num_minibatches=transitions.batch_size + 1)
+
+    def test_update_epochs_bad_adv(self):
+        pi = Policy(self.func_pi_discrete, self.env_discrete)
+        updater = PPOClip(pi)
+        transitions = self.transitions_discrete
+
+        with self.assertRaisesRegex(ValueError, r"Adv must have shape"):
+            updater.update_epochs(transitions, Adv=transitions.Rn[:-1], num_minibatches=1)
+
+    def test_update_epochs_nan(self):
+        pi = Policy(self.func_pi_discrete, self.env_discrete)
+        updater = PPOClip(pi, optimizer=sgd(1.0))
+        transitions = self.transitions_discrete
+
+        params = deepcopy(pi.params)
+        Adv = jnp.full_like(transitions.Rn, jnp.nan)
+        with self.assertRaisesRegex(RuntimeError, r"found nan's in grads"):
+            updater.update_epochs(transitions, Adv=Adv, num_epochs=1, num_minibatches=1)
+        self.assertPytreeAlmostEqual(params, pi.params)
+
+        # the optimizer state wasn't donated, so we can carry on
+        updater.update_epochs(transitions, Adv=transitions.Rn, num_epochs=1, num_minibatches=1)
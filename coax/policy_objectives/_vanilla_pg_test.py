@@ -115,6 +115,41 @@ class TestVanillaPG(TestCase):
         self.assertPytreeNotEqual(function_state, pi.function_state)
         self.assertPytreeNotEqual(params, pi.params)
 
+    def test_hyperparams_track_regularizer(self):
+        pi = Policy(self.func_pi_discrete, self.env_discrete)
+        regularizer = KLDivRegularizer(pi, beta=0.1)
+        updater = VanillaPG(pi, regularizer=regularizer)
+        self.assertEqual(updater.hyperparams['regularizer']['beta'], 0.1)
+        self.assertIs(updater.hyperparams, updater.hyperparams)  # cached between reassignments
+
+        regularizer.beta = 0.2
+        self.assertEqual(updater.hyperparams['regularizer']['beta'], 0.2)
+        self.assertIs(updater.hyperparams, updater.hyperparams)
+
+        # reassign the priors multiple times between reads
+        logits = regularizer.priors['logits']
+        for i in range(3):
+            regularizer.priors = {'logits': jnp.full_like(logits, float(i))}
+            _ = updater.hyperparams
+            regularizer.priors = {'logits': jnp.full_like(logits, float(i) + 0.5)}
+            self.assertArrayAlmostEqual(
+                updater.hyperparams['regularizer']['priors']['logits'],
+                jnp.full_like(logits, float(i) + 0.5))
+
+        # same for the entropy regularizer
+        regularizer = EntropyRegularizer(pi, beta=0.1)
+        updater = VanillaPG(pi, regularizer=regularizer)
+        hyperparams = updater.hyperparams
+        self.assertIs(updater.hyperparams, hyperparams)
+        regularizer.beta = 0.3
+        self.assertIsNot(updater.hyperparams, hyperparams)
+        self.assertEqual(updater.hyperparams['regularizer']['beta'], 0.3)
+
+        # no regularizer
+        updater = VanillaPG(pi)
+        self.assertIs(updater.hyperparams, updater.hyperparams)
+        self.assertEqual(dict(updater.hyperparams['regularizer']), {})
+
     def test_update_discrete_kldivreg(self):
         env = self.env_discrete
         func = self.func_pi_discrete
@@ -66,9 +66,21 @@ class EntropyRegularizer(Regularizer):
         self._function = jit(function)
         self._metrics_func = jit(metrics)
 
+    @property
+    def beta(self):
+        return self._beta
+
+    @beta.setter
+    def beta(self, new_beta):
+        self._beta = new_beta
+        self._hyperparams = None  # invalidate cache
+
     @property
     def hyperparams(self):
-        return {'beta': self.beta}
+        # cached, so that consumers can tell by identity whether any hyperparams were reassigned
+        if self._hyperparams is None:
+            self._hyperparams = {'beta': self.beta}
+        return self._hyperparams
 
     @property
     def function(self):
@@ -77,9 +77,30 @@ class KLDivRegularizer(Regularizer):
         self._function = jit(function)
         self._metrics_func = jit(metrics)
 
+    @property
+    def beta(self):
+        return self._beta
+
+    @beta.setter
+    def beta(self, new_beta):
+        self._beta = new_beta
+        self._hyperparams = None  # invalidate cache
+
+    @property
+    def priors(self):
+        return self._priors
+
+    @priors.setter
+    def priors(self, new_priors):
+        self._priors = new_priors
+        self._hyperparams = None  # invalidate cache
+
     @property
     def hyperparams(self):
-        return {'beta': self.beta, 'priors': self.priors}
+        # cached, so that consumers can tell by identity whether any hyperparams were reassigned
+        if self._hyperparams is None:
+            self._hyperparams = {'beta': self.beta, 'priors': self.priors}
+        return self._hyperparams
 
     @property
     def function(self):
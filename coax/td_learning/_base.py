@@ -28,7 +28,9 @@ import optax
 import chex
 
 from .._base.mixins import RandomStateMixin
-from ..utils import get_grads_diagnostics, is_policy, is_stochastic, is_qfunction, is_vfunction, jit
+from ..utils import (
+    get_grads_diagnostics, is_policy, is_stochastic, is_qfunction, is_vfunction, jit, pmap,
+    pmean_grads_and_metrics, rejit, shard_batch, unreplicate)
 from ..value_losses import huber
 from ..regularizers import Regularizer
 
@@ -60,7 +62,8 @@ class BaseTDLearning(ABC, RandomStateMixin):
             new_params = optax.apply_updates(params, updates)
             return new_opt_state, new_params
 
-        self._apply_grads_func = jit(apply_grads_func, static_argnums=0)
+        # donate opt_state; we can't donate params, because params are shared with shallow copies
+        self._apply_grads_func = jit(apply_grads_func, static_argnums=0, donate_argnums=1)
 
     @abstractmethod
     def target_func(self, target_params, target_state, rng, transition_batch):
@@ -167,7 +170,7 @@ class BaseTDLearning(ABC, RandomStateMixin):
         """
         return self._grads_and_metrics_func(
             self._f.params, self.target_params, self._f.function_state, self.target_function_state,
-            self._f.rng, transition_batch)
+            self._f.rng, self._slim_transition_batch(transition_batch))
 
     def td_error(self, transition_batch):
         r"""
@@ -182,6 +185,12 @@ class BaseTDLearning(ABC, RandomStateMixin):
         Note that this reduces to the ordinary definition :math:`\text{td_error}=y-\hat{y}` when we
         use the :func:`coax.value_losses.mse` loss funtion.
 
+        Note that the TD-errors are a by-product of computing the gradients. So if you also intend
+        to update the model, e.g. when updating the priorities of a :class:`PrioritizedReplayBuffer
+        <coax.experience_replay.PrioritizedReplayBuffer>`, it's more efficient to get them from
+        :func:`update(..., return_td_error=True) <update>` instead, which avoids an additional
+        forward pass.
+
         Parameters
         ----------
         transition_batch : TransitionBatch
@@ -197,7 +206,45 @@ class BaseTDLearning(ABC, RandomStateMixin):
         """
         return self._td_error_func(
             self._f.params, self.target_params, self._f.function_state, self.target_function_state,
-            self._f.rng, transition_batch)
+            self._f.rng, self._slim_transition_batch(transition_batch))
+
+    def _slim_transition_batch(self, transition_batch):
+        # derived classes may drop the fields they don't use, so we don't transfer them to device
+        return transition_batch
+
+    def compile(self, transition_batch):
+        r"""
+
+        Compile the update functions ahead of time for inputs of the given shapes and dtypes.
+
+        By default, the update functions are compiled upon first use, which blocks the first call
+        to :attr:`update`. This method can be used to shift the compilation cost to a moment of
+        choosing, e.g. right after construction. Nothing is executed, and none of the model
+        parameters or the optimizer state is changed. Note that changing an input shape (e.g. the
+        batch size) triggers a recompilation.
+
+        Parameters
+        ----------
+        transition_batch : TransitionBatch
+
+            A representative batch of transitions.
+
+        """
+        rng = jax.random.PRNGKey(0)  # only the shape and dtype matter
+        args = (
+            self._f.params, self.target_params, self._f.function_state, self.target_function_state,
+            rng, self._slim_transition_batch(transition_batch))
+        self._grads_and_metrics_func.lower(*args).compile()
+        self._td_error_func.lower(*args).compile()
+        grads = jax.tree_map(jnp.zeros_like, self._f.params)
+        self._apply_grads_func.lower(
+            self.optimizer, self.optimizer_state, self._f.params, grads).compile()
+
+    def _rejit(self):
+        # static settings are baked into the compiled graph, so we need to re-jit
+        for name in ('_grads_and_metrics_func', '_td_error_func', '_grads_and_metrics_pmap_func'):
+            if hasattr(self, name):
+                setattr(self, name, rejit(getattr(self, name)))
 
     @property
     def optimizer(self):
@@ -266,8 +313,8 @@ class BaseTDLearningV(BaseTDLearning):
 
             if is_stochastic(self.v):
                 dist_params, state_new = self.v.function(params, state, next(rngs), S, True)
-                dist_params_target = \
-                    self.target_func(target_params, target_state, rng, transition_batch)
+                dist_params_target = jax.lax.stop_gradient(  # the target is treated as constant
+                    self.target_func(target_params, target_state, rng, transition_batch))
 
                 if self.policy_regularizer is not None:
                     dist_params_target = self.v.proba_dist.affine_transform(
@@ -280,20 +327,28 @@ class BaseTDLearningV(BaseTDLearning):
                 V = self.v.proba_dist.postprocess_variate(next(rngs), V, batch_mode=True)
                 G = self.v.proba_dist.mean(dist_params_target)
                 G = self.v.proba_dist.postprocess_variate(next(rngs), G, batch_mode=True)
-                dist_params_v_targ, _ = self.v.function(
-                    target_params['v_targ'], target_state['v_targ'], next(rngs), S, False)
-                V_targ = self.v.proba_dist.mean(dist_params_v_targ)
-                V_targ = self.v.proba_dist.postprocess_variate(next(rngs), V_targ, batch_mode=True)
+                if self.v_targ is self.v:
+                    V_targ = jax.lax.stop_gradient(V)  # no need for a separate forward pass
+                else:
+                    dist_params_v_targ, _ = self.v.function(
+                        target_params['v_targ'], target_state['v_targ'], next(rngs), S, False)
+                    V_targ = self.v.proba_dist.mean(dist_params_v_targ)
+                    V_targ = self.v.proba_dist.postprocess_variate(
+                        next(rngs), V_targ, batch_mode=True)
 
             else:
                 V, state_new = self.v.function(params, state, next(rngs), S, True)
-                G = self.target_func(target_params, target_state, next(rngs), transition_batch)
+                G = jax.lax.stop_gradient(  # the target is treated as constant
+                    self.target_func(target_params, target_state, next(rngs), transition_batch))
                 G += regularizer
                 loss = self.loss_function(G, V, W)
 
                 # only needed for metrics dict
-                V_targ, _ = self.v.function(
-                    target_params['v_targ'], target_state['v_targ'], next(rngs), S, False)
+                if self.v_targ is self.v:
+                    V_targ = jax.lax.stop_gradient(V)  # no need for a separate forward pass
+                else:
+                    V_targ, _ = self.v.function(
+                        target_params['v_targ'], target_state['v_targ'], next(rngs), S, False)
 
             chex.assert_equal_shape([G, V, V_targ, W])
             chex.assert_rank([G, V, V_targ, W], 1)
@@ -301,7 +356,6 @@ class BaseTDLearningV(BaseTDLearning):
             td_error = -V.shape[0] * dLoss_dV(G, V)  # e.g. (G - V) if loss function is MSE
             chex.assert_equal_shape([td_error, W])
             metrics = {
-                f'{self.__class__.__name__}/loss': loss,
                 f'{self.__class__.__name__}/td_error': jnp.mean(W * td_error),
                 f'{self.__class__.__name__}/td_error_targ': jnp.mean(-dLoss_dV(V, V_targ, W)),
             }
@@ -311,8 +365,10 @@ class BaseTDLearningV(BaseTDLearning):
                 params, target_params, state, target_state, rng, transition_batch):
 
             rngs = hk.PRNGSequence(rng)
-            grads, (td_error, state_new, metrics) = jax.grad(loss_func, has_aux=True)(
-                params, target_params, state, target_state, next(rngs), transition_batch)
+            (loss, (td_error, state_new, metrics)), grads = \
+                jax.value_and_grad(loss_func, has_aux=True)(
+                    params, target_params, state, target_state, next(rngs), transition_batch)
+            metrics = {f'{self.__class__.__name__}/loss': loss, **metrics}
 
             # add some diagnostics about the gradients
             metrics.update(get_grads_diagnostics(grads, f'{self.__class__.__name__}/grads_'))
@@ -367,7 +423,9 @@ class BaseTDLearningV(BaseTDLearning):
 
 
 class BaseTDLearningQ(BaseTDLearning):
-    def __init__(self, q, q_targ=None, optimizer=None, loss_function=None, policy_regularizer=None):
+    def __init__(
+            self, q, q_targ=None, optimizer=None, loss_function=None, policy_regularizer=None,
+            clip_delta=None):
 
         if not is_qfunction(q):
             raise TypeError(f"q must be a q-function, got: {type(q)}")
@@ -396,9 +454,11 @@ class BaseTDLearningQ(BaseTDLearning):
             -kris
 
             """
-            rngs = hk.PRNGSequence(rng)
-            S = self.q.observation_preprocessor(next(rngs), transition_batch.S)
-            A = self.q.action_preprocessor(next(rngs), transition_batch.A)
+            # a single split is cheaper than hk.PRNGSequence
+            (rng_s, rng_a, rng_reg, rng_f, rng_targ, rng_f_targ,
+             rng_pp_q, rng_pp_g, rng_pp_q_targ) = jax.random.split(rng, 9)
+            S = self.q.observation_preprocessor(rng_s, transition_batch.S)
+            A = self.q.action_preprocessor(rng_a, transition_batch.A)
             W = jnp.clip(transition_batch.W, 0.1, 10.)  # clip importance weights to reduce variance
 
             # regularization term
@@ -408,13 +468,13 @@ class BaseTDLearningQ(BaseTDLearning):
                 # flip sign (typical example: regularizer = -beta * entropy)
                 regularizer = -self.policy_regularizer.batch_eval(
                     target_params['reg'], target_params['reg_hparams'], target_state['reg'],
-                    next(rngs), transition_batch)
+                    rng_reg, transition_batch)
 
             if is_stochastic(self.q):
                 dist_params, state_new = \
-                    self.q.function_type1(params, state, next(rngs), S, A, True)
-                dist_params_target = \
-                    self.target_func(target_params, target_state, rng, transition_batch)
+                    self.q.function_type1(params, state, rng_f, S, A, True)
+                dist_params_target = jax.lax.stop_gradient(  # the target is treated as constant
+                    self.target_func(target_params, target_state, rng_targ, transition_batch))
 
                 if self.policy_regularizer is not None:
                     dist_params_target = self.q.proba_dist.affine_transform(
@@ -424,23 +484,37 @@ class BaseTDLearningQ(BaseTDLearning):
 
                 # the rest here is only needed for metrics dict
                 Q = self.q.proba_dist.mean(dist_params)
-                Q = self.q.proba_dist.postprocess_variate(next(rngs), Q, batch_mode=True)
+                Q = self.q.proba_dist.postprocess_variate(rng_pp_q, Q, batch_mode=True)
                 G = self.q.proba_dist.mean(dist_params_target)
-                G = self.q.proba_dist.postprocess_variate(next(rngs), G, batch_mode=True)
-                dist_params_q_targ, _ = self.q.function_type1(
-                    target_params['q_targ'], target_state['q_targ'], next(rngs), S, A, False)
-                Q_targ = self.q.proba_dist.mean(dist_params_q_targ)
-                Q_targ = self.q.proba_dist.postprocess_variate(next(rngs), Q_targ, batch_mode=True)
+                G = self.q.proba_dist.postprocess_variate(rng_pp_g, G, batch_mode=True)
+                if self.q_targ is self.q:
+                    Q_targ = jax.lax.stop_gradient(Q)  # no need for a separate forward pass
+                else:
+                    dist_params_q_targ, _ = self.q.function_type1(
+                        target_params['q_targ'], target_state['q_targ'], rng_f_targ, S, A, False)
+                    Q_targ = self.q.proba_dist.mean(dist_params_q_targ)
+                    Q_targ = self.q.proba_dist.postprocess_variate(
+                        rng_pp_q_targ, Q_targ, batch_mode=True)
 
             else:
-                Q, state_new = self.q.function_type1(params, state, next(rngs), S, A, True)
-                G = self.target_func(target_params, target_state, next(rngs), transition_batch)
+                Q, state_new = self.q.function_type1(params, state, rng_f, S, A, True)
+                G = jax.lax.stop_gradient(  # the target is treated as constant
+                    self.target_func(target_params, target_state, rng_targ, transition_batch))
                 G += regularizer
-                loss = self.loss_function(G, Q, W)
+                if self._clip_delta is None:
+                    loss = self.loss_function(G, Q, W)
+                else:
+                    # regress to a target that's at most clip_delta away from the prediction
+                    G_clip = jax.lax.stop_gradient(
+                        Q + jnp.clip(G - Q, -self._clip_delta, self._clip_delta))
+                    loss = self.loss_function(G_clip, Q, W)
 
                 # only needed for metrics dict
-                Q_targ, _ = self.q.function_type1(
-                    target_params['q_targ'], target_state['q_targ'], next(rngs), S, A, False)
+                if self.q_targ is self.q:
+                    Q_targ = jax.lax.stop_gradient(Q)  # no need for a separate forward pass
+                else:
+                    Q_targ, _ = self.q.function_type1(
+                        target_params['q_targ'], target_state['q_targ'], rng_f_targ, S, A, False)
 
             chex.assert_equal_shape([G, Q, Q_targ, W])
             chex.assert_rank([G, Q, Q_targ, W], 1)
@@ -448,7 +522,6 @@ class BaseTDLearningQ(BaseTDLearning):
             td_error = -Q.shape[0] * dLoss_dQ(G, Q)  # e.g. (G - Q) if loss function is MSE
             chex.assert_equal_shape([td_error, W])
             metrics = {
-                f'{self.__class__.__name__}/loss': loss,
                 f'{self.__class__.__name__}/td_error': jnp.mean(W * td_error),
                 f'{self.__class__.__name__}/td_error_targ': jnp.mean(-dLoss_dQ(Q, Q_targ, W)),
             }
@@ -457,9 +530,10 @@ class BaseTDLearningQ(BaseTDLearning):
         def grads_and_metrics_func(
                 params, target_params, state, target_state, rng, transition_batch):
 
-            rngs = hk.PRNGSequence(rng)
-            grads, (td_error, state_new, metrics) = jax.grad(loss_func, has_aux=True)(
-                params, target_params, state, target_state, next(rngs), transition_batch)
+            (loss, (td_error, state_new, metrics)), grads = \
+                jax.value_and_grad(loss_func, has_aux=True)(
+                    params, target_params, state, target_state, rng, transition_batch)
+            metrics = {f'{self.__class__.__name__}/loss': loss, **metrics}
 
             # add some diagnostics about the gradients
             metrics.update(get_grads_diagnostics(grads, f'{self.__class__.__name__}/grads_'))
@@ -471,8 +545,76 @@ class BaseTDLearningQ(BaseTDLearning):
                 loss_func(params, target_params, state, target_state, rng, transition_batch)
             return td_error
 
+        def grads_and_metrics_pmap_func(
+                params, target_params, state, target_state, rng, transition_batch):
+
+            rng = jax.random.fold_in(rng, jax.lax.axis_index('devices'))  # decorrelate devices
+            grads, state_new, metrics, td_error = grads_and_metrics_func(
+                params, target_params, state, target_state, rng, transition_batch)
+            grads, state_new, metrics = pmean_grads_and_metrics(
+                grads, state_new, metrics, 'devices', f'{self.__class__.__name__}/grads_')
+            return grads, state_new, metrics, td_error
+
         self._grads_and_metrics_func = jit(grads_and_metrics_func)
+        self._grads_and_metrics_pmap_func = pmap(
+            grads_and_metrics_pmap_func, axis_name='devices',
+            in_axes=(None, None, None, None, None, 0))
         self._td_error_func = jit(td_error_func)
+        self.clip_delta = clip_delta
+
+    @property
+    def clip_delta(self):
+        return self._clip_delta
+
+    @clip_delta.setter
+    def clip_delta(self, new_clip_delta):
+        if new_clip_delta is not None and not new_clip_delta > 0:
+            raise ValueError(f"clip_delta must be a positive number, got: {new_clip_delta}")
+        self._clip_delta = None if new_clip_delta is None else float(new_clip_delta)
+        self._rejit()
+
+    def update_data_parallel(self, transition_batch, return_td_error=False):
+        r"""
+
+        Update the model parameters (weights) of the underlying function approximator, where the
+        computation of the gradients is distributed over all local devices.
+
+        The batch is split into :code:`jax.local_device_count()` equal shards. Each device computes
+        the gradients for its own shard, after which the gradients, function state and metrics are
+        averaged over devices. The model parameters are broadcast to all devices.
+
+        Parameters
+        ----------
+        transition_batch : TransitionBatch
+
+            A batch of transitions. The batch size must be divisible by the number of devices.
+
+        return_td_error : bool, optional
+
+            Whether to return the TD-errors.
+
+        Returns
+        -------
+        metrics : dict of scalar ndarrays
+
+            The structure of the metrics dict is ``{name: score}``.
+
+        td_error : ndarray, optional
+
+            The non-aggregated TD-errors, :code:`shape == (batch_size,)`. This is only returned if
+            we set :code:`return_td_error=True`.
+
+        """
+        grads, function_state, metrics, td_error = self._grads_and_metrics_pmap_func(
+            self._f.params, self.target_params, self._f.function_state, self.target_function_state,
+            self._f.rng,
+            shard_batch(self._slim_transition_batch(transition_batch), jax.local_device_count()))
+        grads, function_state, metrics = unreplicate((grads, function_state, metrics))
+        td_error = td_error.reshape(-1)  # undo sharding
+        if any(jnp.any(jnp.isnan(g)) for g in jax.tree_leaves(grads)):
+            raise RuntimeError(f"found nan's in grads: {grads}")
+        self.update_from_grads(grads, function_state)
+        return (metrics, td_error) if return_td_error else metrics
 
     @property
     def q(self):
@@ -517,7 +659,7 @@ class BaseTDLearningQ(BaseTDLearning):
 class BaseTDLearningQWithTargetPolicy(BaseTDLearningQ):
     def __init__(
             self, q, pi_targ, q_targ=None, optimizer=None,
-            loss_function=None, policy_regularizer=None):
+            loss_function=None, policy_regularizer=None, clip_delta=None):
 
         if pi_targ is not None and not is_policy(pi_targ):
             raise TypeError(f"pi_targ must be a Policy, got: {type(pi_targ)}")
@@ -528,7 +670,8 @@ class BaseTDLearningQWithTargetPolicy(BaseTDLearningQ):
             q_targ=q_targ,
             optimizer=optimizer,
             loss_function=loss_function,
-            policy_regularizer=policy_regularizer)
+            policy_regularizer=policy_regularizer,
+            clip_delta=clip_delta)
 
     @property
     def target_params(self):
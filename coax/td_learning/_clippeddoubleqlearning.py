@@ -155,7 +155,8 @@ class ClippedDoubleQLearning(BaseTDLearning):  # TODO(krholshe): make this less
                     next(rngs), transition_batch)
 
             Q, state_new = self.q.function_type1(params, state, next(rngs), S, A, True)
-            G = self.target_func(target_params, target_state, next(rngs), transition_batch)
+            G = jax.lax.stop_gradient(  # the target is treated as constant
+                self.target_func(target_params, target_state, next(rngs), transition_batch))
             G += regularizer
             loss = self.loss_function(G, Q, W)
 
@@ -175,7 +176,6 @@ class ClippedDoubleQLearning(BaseTDLearning):  # TODO(krholshe): make this less
 
             chex.assert_equal_shape([td_error, W, Q_targ])
             metrics = {
-                f'{self.__class__.__name__}/loss': loss,
                 f'{self.__class__.__name__}/td_error': jnp.mean(W * td_error),
                 f'{self.__class__.__name__}/td_error_targ': jnp.mean(-dLoss_dQ(Q, Q_targ, W)),
             }
@@ -185,8 +185,10 @@ class ClippedDoubleQLearning(BaseTDLearning):  # TODO(krholshe): make this less
                 params, target_params, state, target_state, rng, transition_batch):
 
             rngs = hk.PRNGSequence(rng)
-            grads, (td_error, state_new, metrics) = jax.grad(loss_func, has_aux=True)(
-                params, target_params, state, target_state, next(rngs), transition_batch)
+            (loss, (td_error, state_new, metrics)), grads = \
+                jax.value_and_grad(loss_func, has_aux=True)(
+                    params, target_params, state, target_state, next(rngs), transition_batch)
+            metrics = {f'{self.__class__.__name__}/loss': loss, **metrics}
 
             # add some diagnostics about the gradients
             metrics.update(get_grads_diagnostics(grads, f'{self.__class__.__name__}/grads_'))
@@ -21,10 +21,12 @@
 
 import warnings
 
-import haiku as hk
+import jax
+import jax.numpy as jnp
 import chex
 from gym.spaces import Discrete
 
+from ..reward_tracing import TransitionBatch
 from ..utils import is_stochastic
 from ._base import BaseTDLearningQWithTargetPolicy
 
@@ -110,10 +112,28 @@ class QLearning(BaseTDLearningQWithTargetPolicy):
         Note that the coefficient :math:`\beta` plays the role of the temperature in SAC-style
         agents.
 
+    target_dtype : dtype, optional
+
+        If provided, the forward pass through :code:`q_targ` that is used to construct the
+        bootstrapped target is done in this (reduced) precision, e.g. :code:`jnp.bfloat16`. This
+        reduces the memory bandwidth of the target computation. The resulting q-values are cast
+        back to full precision before they're combined with the rewards. This option is ignored for
+        stochastic q-functions. The forward pass through :code:`q` that is used in computing the
+        gradients is always done in full precision.
+
+    clip_delta : positive float, optional
+
+        If provided, the bootstrapped target is clipped to lie within :code:`clip_delta` of the
+        current prediction before it's passed to the loss function, i.e. the residual that enters
+        the loss is :math:`\text{clip}(G-q(S,A), -c, c)`. This keeps individual updates within a
+        trust region around the current q-function. The reported TD errors are not clipped. This
+        option is ignored for stochastic q-functions.
+
     """
     def __init__(
             self, q, pi_targ=None, q_targ=None,
-            optimizer=None, loss_function=None, policy_regularizer=None):
+            optimizer=None, loss_function=None, policy_regularizer=None, target_dtype=None,
+            clip_delta=None):
 
         super().__init__(
             q=q,
@@ -121,30 +141,73 @@ class QLearning(BaseTDLearningQWithTargetPolicy):
             q_targ=q_targ,
             optimizer=optimizer,
             loss_function=loss_function,
-            policy_regularizer=policy_regularizer)
+            policy_regularizer=policy_regularizer,
+            clip_delta=clip_delta)
 
         # consistency checks
         if self.pi_targ is None and not isinstance(self.q.action_space, Discrete):
             raise TypeError("pi_targ must be provided if action space is not discrete")
         if self.pi_targ is not None and isinstance(self.q.action_space, Discrete):
             warnings.warn("pi_targ is ignored, because action space is discrete")
+        if target_dtype is not None and is_stochastic(self.q):
+            warnings.warn("target_dtype is ignored, because q is stochastic")
+        if clip_delta is not None and is_stochastic(self.q):
+            warnings.warn("clip_delta is ignored, because q is stochastic")
+
+        self.target_dtype = target_dtype
+
+    @property
+    def target_dtype(self):
+        return self._target_dtype
+
+    @target_dtype.setter
+    def target_dtype(self, new_target_dtype):
+        if new_target_dtype is not None:
+            new_target_dtype = jnp.dtype(new_target_dtype)
+            if not jnp.issubdtype(new_target_dtype, jnp.floating):
+                raise ValueError(
+                    f"target_dtype must be a floating point dtype, got: {new_target_dtype}")
+        self._target_dtype = new_target_dtype
+        self._rejit()
+
+    def _slim_transition_batch(self, transition_batch):
+        # q-learning doesn't use the propensities nor the next actions
+        return TransitionBatch(
+            S=transition_batch.S, A=transition_batch.A, logP=None, Rn=transition_batch.Rn,
+            In=transition_batch.In, S_next=transition_batch.S_next, W=transition_batch.W,
+            idx=transition_batch.idx)
 
     def target_func(self, target_params, target_state, rng, transition_batch):
-        rngs = hk.PRNGSequence(rng)
+        # a single split is cheaper than hk.PRNGSequence; the first three keys are for the greedy
+        # action, the last two for evaluating it on q_targ
+        rng_s, rng_f, rng_pp, rng_s_targ, rng_f_targ = jax.random.split(rng, 5)
+        f, f_inv = self.q.value_transform.transform_func, self.q_targ.value_transform.inverse_func
 
         if isinstance(self.q.action_space, Discrete):
             params, state = target_params['q_targ'], target_state['q_targ']
-            S_next = self.q_targ.observation_preprocessor(next(rngs), transition_batch.S_next)
+            S_next = self.q_targ.observation_preprocessor(rng_s, transition_batch.S_next)
 
             if is_stochastic(self.q):
-                Q_s = self.q_targ.mean_func_type2(params, state, next(rngs), S_next)
-                Q_s = self.q_targ.proba_dist.postprocess_variate(next(rngs), Q_s, batch_mode=True)
+                Q_s = self.q_targ.mean_func_type2(params, state, rng_f, S_next)
+                Q_s = self.q_targ.proba_dist.postprocess_variate(rng_pp, Q_s, batch_mode=True)
+            elif self._target_dtype is None:
+                Q_s, _ = self.q_targ.function_type2(params, state, rng_f, S_next, False)
             else:
-                Q_s, _ = self.q_targ.function_type2(params, state, next(rngs), S_next, False)
+                # the dtype of the q-values at full precision, which we cast back to below
+                Q_s_dtype = _output_dtype(self.q_targ.function_type2, params, state, rng_f, S_next)
+                params, state, S_next = _cast_floats((params, state, S_next), self._target_dtype)
+                Q_s, _ = self.q_targ.function_type2(params, state, rng_f, S_next, False)
+                Q_s = Q_s.astype(Q_s_dtype)
 
             chex.assert_rank(Q_s, 2)
             assert Q_s.shape[1] == self.q_targ.action_space.n
 
+            if not is_stochastic(self.q):
+                # we already have q_targ(s_next,.), so there's no need for another forward pass
+                A_next = jnp.argmax(Q_s, axis=1)
+                Q_sa_next = jnp.take_along_axis(Q_s, A_next[:, None], axis=1).squeeze(axis=1)
+                return f(transition_batch.Rn + transition_batch.In * f_inv(Q_sa_next))
+
             # get greedy action as the argmax over q_targ
             A_next = (Q_s == Q_s.max(axis=1, keepdims=True)).astype(Q_s.dtype)
             A_next /= A_next.sum(axis=1, keepdims=True)  # there may be ties
@@ -152,16 +215,35 @@ class QLearning(BaseTDLearningQWithTargetPolicy):
         else:
             # get greedy action as the mode of pi_targ
             params, state = target_params['pi_targ'], target_state['pi_targ']
-            S_next = self.pi_targ.observation_preprocessor(next(rngs), transition_batch.S_next)
-            A_next = self.pi_targ.mode_func(params, state, next(rngs), S_next)
+            S_next = self.pi_targ.observation_preprocessor(rng_s, transition_batch.S_next)
+            A_next = self.pi_targ.mode_func(params, state, rng_f, S_next)
 
         # evaluate on q_targ
         params, state = target_params['q_targ'], target_state['q_targ']
-        S_next = self.q_targ.observation_preprocessor(next(rngs), transition_batch.S_next)
+        S_next = self.q_targ.observation_preprocessor(rng_s_targ, transition_batch.S_next)
 
         if is_stochastic(self.q):
-            return self._get_target_dist_params(params, state, next(rngs), transition_batch, A_next)
+            return self._get_target_dist_params(params, state, rng_f_targ, transition_batch, A_next)
 
-        Q_sa_next, _ = self.q.function_type1(params, state, next(rngs), S_next, A_next, False)
-        f, f_inv = self.q.value_transform.transform_func, self.q_targ.value_transform.inverse_func
+        if self._target_dtype is None:
+            Q_sa_next, _ = self.q.function_type1(params, state, rng_f_targ, S_next, A_next, False)
+        else:
+            # the dtype of the q-values at full precision, which we cast back to below
+            Q_sa_next_dtype = _output_dtype(
+                self.q.function_type1, params, state, rng_f_targ, S_next, A_next)
+            params, state, S_next, A_next = \
+                _cast_floats((params, state, S_next, A_next), self._target_dtype)
+            Q_sa_next, _ = self.q.function_type1(params, state, rng_f_targ, S_next, A_next, False)
+            Q_sa_next = Q_sa_next.astype(Q_sa_next_dtype)
         return f(transition_batch.Rn + transition_batch.In * f_inv(Q_sa_next))
+
+
+def _output_dtype(function, *args, is_training=False):
+    # abstract evaluation only, i.e. this doesn't add a forward pass to the compiled graph
+    output, _ = jax.eval_shape(lambda *args: function(*args, is_training), *args)
+    return output.dtype
+
+
+def _cast_floats(pytree, dtype):
+    return jax.tree_map(
+        lambda x: x.astype(dtype) if jnp.issubdtype(x.dtype, jnp.floating) else x, pytree)
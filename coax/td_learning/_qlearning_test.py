@@ -21,12 +21,17 @@
 
 from copy import deepcopy
 
+import jax
+import jax.numpy as jnp
+import numpy as onp
+import haiku as hk
 from optax import sgd
 
 from .._base.test_case import TestCase
 from .._core.q import Q
 from .._core.policy import Policy
 from ..utils import get_transition_batch
+from ..value_losses import mse
 from ._qlearning import QLearning
 
 
@@ -68,6 +73,139 @@ class TestQLearning(TestCase):
         self.assertPytreeNotEqual(params, q.params)
         self.assertPytreeNotEqual(function_state, q.function_state)
 
+    def test_compile(self):
+        q = Q(self.func_q_type2, self.env_discrete)
+        updater = QLearning(q, q_targ=q.copy(), optimizer=sgd(1.0))
+
+        params = deepcopy(q.params)
+        updater.compile(self.transition_discrete)
+        self.assertPytreeAlmostEqual(params, q.params)
+
+        updater.update(self.transition_discrete)
+        self.assertPytreeNotEqual(params, q.params)
+
+    def test_update_data_parallel(self):
+        env = self.env_discrete
+
+        def func(S, is_training):
+            # no batch norm, so that the shards see the same function as the full batch
+            seq = hk.Sequential((
+                hk.Flatten(), hk.Linear(7), jnp.tanh, hk.Linear(env.action_space.n)))
+            return seq(S)
+
+        # batch size must be divisible by jax.local_device_count()
+        tn = get_transition_batch(env, batch_size=8, random_seed=13)
+
+        q = Q(func, env)
+        updater = QLearning(q, q_targ=q.copy(), optimizer=sgd(1.0))
+
+        params = deepcopy(q.params)
+        grads, _, metrics_expected, td_error_expected = updater.grads_and_metrics(tn)
+
+        metrics, td_error = updater.update_data_parallel(tn, return_td_error=True)
+        self.assertEqual(metrics['QLearning/loss'].shape, ())
+        self.assertEqual(td_error.shape, (tn.batch_size,))
+        self.assertPytreeNotEqual(params, q.params)
+
+        # sgd(1.0) means that the params are shifted by exactly -grads
+        params_expected = jax.tree_map(lambda p, g: p - g, params, grads)
+        self.assertPytreeAlmostEqual(params_expected, q.params, decimal=5)
+        self.assertPytreeAlmostEqual(td_error_expected, td_error, decimal=5)
+        self.assertPytreeAlmostEqual(metrics, metrics_expected, decimal=5)
+
+    def test_slim_transition_batch(self):
+        q = Q(self.func_q_type2, self.env_discrete)
+        updater = QLearning(q, q_targ=q.copy())
+        tn = self.transition_discrete
+
+        tn_slim = updater._slim_transition_batch(tn)
+        self.assertIsNone(tn_slim.logP)
+        self.assertIsNone(tn_slim.A_next)
+        self.assertIsNone(tn_slim.logP_next)
+        self.assertArrayAlmostEqual(tn_slim.W, tn.W)
+        self.assertArrayAlmostEqual(tn_slim.idx, tn.idx)
+
+    def test_target_discrete_type2(self):
+        q = Q(self.func_q_type2, self.env_discrete)
+        updater = QLearning(q, q_targ=q.copy())
+        tn = self.transition_discrete
+
+        G = updater.target_func(updater.target_params, updater.target_function_state, q.rng, tn)
+        S_next = q.observation_preprocessor(q.rng, tn.S_next)
+        Q_s_next, _ = q.function_type2(q.params, q.function_state, q.rng, S_next, False)
+        self.assertArrayAlmostEqual(G, tn.Rn + tn.In * jnp.max(Q_s_next, axis=1))
+
+    def test_target_integer_rewards(self):
+        q = Q(self.func_q_type2, self.env_discrete, random_seed=13)
+        tn = get_transition_batch(self.env_discrete, batch_size=4, random_seed=7)
+        tn.Rn = onp.ones(4, dtype='int32')
+        tn.In = onp.full(4, 0.9, dtype='float32')
+        S_next = q.observation_preprocessor(q.rng, tn.S_next)
+        Q_s_next, _ = q.function_type2(q.params, q.function_state, q.rng, S_next, False)
+        G_expected = tn.Rn + tn.In * jnp.max(Q_s_next, axis=1)
+
+        for target_dtype in (None, jnp.bfloat16):
+            updater = QLearning(q, q_targ=q.copy(), target_dtype=target_dtype)
+            G = updater.target_func(
+                updater.target_params, updater.target_function_state, q.rng, tn)
+            self.assertTrue(jnp.issubdtype(G.dtype, jnp.floating))
+            # compare absolute errors; assertArrayAlmostEqual rescales to [0, 1] first, which
+            # blows up the bfloat16 rounding errors if the spread in G happens to be small
+            atol = 0.1 if target_dtype else 1e-5
+            self.assertLess(float(jnp.max(jnp.abs(G - G_expected))), atol)
+
+    def test_target_dtype(self):
+        q = Q(self.func_q_type2, self.env_discrete)
+        updater = QLearning(q, q_targ=q.copy(), target_dtype=jnp.bfloat16)
+        updater_full = QLearning(q, q_targ=q.copy())
+        tn = self.transition_discrete
+
+        rng = q.rng
+        G = updater.target_func(updater.target_params, updater.target_function_state, rng, tn)
+        G_full = updater_full.target_func(
+            updater_full.target_params, updater_full.target_function_state, rng, tn)
+        self.assertEqual(G.dtype, G_full.dtype)
+        self.assertArrayAlmostEqual(G, G_full, decimal=1)
+
+    def test_target_dtype_setter(self):
+        q = Q(self.func_q_type2, self.env_discrete, random_seed=13)
+        updater = QLearning(q, q_targ=q.copy())
+        tn = get_transition_batch(self.env_discrete, batch_size=8, random_seed=1)
+        td_error_full = updater.td_error(tn)
+
+        updater.target_dtype = 'bfloat16'
+        self.assertEqual(updater.target_dtype, jnp.bfloat16)
+        td_error = updater.td_error(tn)
+        self.assertFalse(jnp.allclose(td_error, td_error_full, rtol=0, atol=1e-6))
+        self.assertLess(float(jnp.max(jnp.abs(td_error - td_error_full))), 0.1)
+
+        with self.assertRaisesRegex(ValueError, r"target_dtype must be a floating point dtype"):
+            updater.target_dtype = 'int32'
+
+    def test_clip_delta(self):
+        q = Q(self.func_q_type2, self.env_discrete)
+        updater = QLearning(q, q_targ=q.copy(), loss_function=mse, clip_delta=1e-3)
+        _, _, metrics, td_error = updater.grads_and_metrics(self.transition_discrete)
+        self.assertLessEqual(float(metrics['QLearning/loss']), 1e-6)
+        self.assertGreater(float(jnp.max(jnp.abs(td_error))), 1e-3)  # td errors aren't clipped
+
+        with self.assertRaisesRegex(ValueError, r"clip_delta must be a positive number"):
+            QLearning(q, clip_delta=0.)
+
+    def test_clip_delta_setter(self):
+        q = Q(self.func_q_type2, self.env_discrete)
+        updater = QLearning(q, q_targ=q.copy(), loss_function=mse)
+        _, _, metrics, _ = updater.grads_and_metrics(self.transition_discrete)
+        self.assertGreater(float(metrics['QLearning/loss']), 1e-6)
+
+        updater.clip_delta = 1e-3
+        self.assertEqual(updater.clip_delta, 1e-3)
+        _, _, metrics, _ = updater.grads_and_metrics(self.transition_discrete)
+        self.assertLessEqual(float(metrics['QLearning/loss']), 1e-6)
+
+        with self.assertRaisesRegex(ValueError, r"clip_delta must be a positive number"):
+            updater.clip_delta = -1.
+
     def test_update_boxspace(self):
         env = self.env_boxspace
         func_q = self.func_q_type1
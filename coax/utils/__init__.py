@@ -45,6 +45,7 @@ Object Reference
     coax.utils.check_array
     coax.utils.check_preprocessors
     coax.utils.clipped_logit
+    coax.utils.configure_memory
     coax.utils.default_preprocessor
     coax.utils.diff_transform
     coax.utils.diff_transform_matrix
@@ -71,13 +72,18 @@ Object Reference
     coax.utils.load
     coax.utils.loads
     coax.utils.merge_dicts
+    coax.utils.pmap
+    coax.utils.pmean_grads_and_metrics
     coax.utils.pretty_print
     coax.utils.pretty_repr
+    coax.utils.rejit
     coax.utils.reload_recursive
     coax.utils.render_episode
     coax.utils.safe_sample
+    coax.utils.shard_batch
     coax.utils.single_to_batch
     coax.utils.tree_ravel
+    coax.utils.unreplicate
 
 
 """
@@ -102,12 +108,16 @@ from ._array import (
     idx,
     isscalar,
     merge_dicts,
+    pmean_grads_and_metrics,
     safe_sample,
+    shard_batch,
     single_to_batch,
     tree_ravel,
+    unreplicate,
 )
-from ._jit import jit
+from ._jit import jit, pmap, rejit
 from ._misc import (
+    configure_memory,
     docstring,
     dump,
     dumps,
@@ -145,6 +155,7 @@ __all__ = (
     'check_preprocessors',
     'chunks_pow2',
     'clipped_logit',
+    'configure_memory',
     'default_preprocessor',
     'diff_transform',
     'diff_transform_matrix',
@@ -171,11 +182,16 @@ __all__ = (
     'load',
     'loads',
     'merge_dicts',
+    'pmap',
+    'pmean_grads_and_metrics',
     'pretty_print',
     'pretty_repr',
+    'rejit',
     'reload_recursive',
     'render_episode',
     'safe_sample',
+    'shard_batch',
     'single_to_batch',
     'tree_ravel',
+    'unreplicate',
 )
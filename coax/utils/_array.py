@@ -28,6 +28,8 @@ import numpy as onp
 import haiku as hk
 from scipy.linalg import pascal
 
+from ._jit import jit
+
 
 __all__ = (
     'StepwiseLinearFunction',
@@ -48,9 +50,12 @@ __all__ = (
     'idx',
     'isscalar',
     'merge_dicts',
+    'pmean_grads_and_metrics',
     'single_to_batch',
     'safe_sample',
+    'shard_batch',
     'tree_ravel',
+    'unreplicate',
 )
 
 
@@ -520,7 +525,7 @@ def double_relu(arr):
 
 
 def _get_leaf_diagnostics(leaf, key_prefix):
-    # update this to add more grads diagnostics
+    # update this to add more grads diagnostics (also update get_grads_diagnostics below)
     return {
         f'{key_prefix}max': jnp.max(jnp.abs(leaf)),
         f'{key_prefix}norm': jnp.linalg.norm(jnp.ravel(leaf)),
@@ -561,7 +566,13 @@ def get_grads_diagnostics(grads, key_prefix='', keep_tree_structure=False):
     """
     if keep_tree_structure:
         return jax.tree_map(lambda g: _get_leaf_diagnostics(g, key_prefix), grads)
-    return _get_leaf_diagnostics(tree_ravel(grads), key_prefix)
+
+    # reduce each leaf separately, which avoids materializing the concatenated (flat) grads
+    leaves = jax.tree_leaves(grads)
+    return {
+        f'{key_prefix}max': jnp.max(jnp.stack([jnp.max(jnp.abs(g)) for g in leaves])),
+        f'{key_prefix}norm': jnp.sqrt(sum(jnp.sum(jnp.square(g)) for g in leaves)),
+    }
 
 
 def get_magnitude_quantiles(pytree, key_prefix=''):
@@ -593,9 +604,15 @@ def get_magnitude_quantiles(pytree, key_prefix=''):
         non-negative floats that represent the magnitude quantiles.
 
     """
-    quantiles = jnp.quantile(jnp.abs(tree_ravel(pytree)), jnp.array([0, 0.25, 0.5, 0.75, 1]))
     quantile_names = (f'{key_prefix}{k}' for k in ('min', 'p25', 'p50', 'p75', 'max'))
-    return dict(zip(quantile_names, quantiles))
+    return dict(zip(quantile_names, _magnitude_quantiles(pytree)))
+
+
+@jit
+def _magnitude_quantiles(pytree):
+    # one fused quantile reduction; returning a tuple of scalars avoids slicing the result later
+    q = jnp.quantile(jnp.abs(tree_ravel(pytree)), jnp.array([0, 0.25, 0.5, 0.75, 1]))
+    return tuple(q)
 
 
 def get_transition_batch(env, batch_size=1, gamma=0.9, random_seed=None):
@@ -805,6 +822,70 @@ class StepwiseLinearFunction:
         return self._intercepts[i] + self._slopes[i] * (timestep - self._offsets[i])
 
 
+def pmean_grads_and_metrics(grads, function_state, metrics, axis_name, grads_key_prefix=''):
+    r"""
+
+    Average the output of a grads-and-metrics function over the devices along a :func:`jax.pmap`
+    axis.
+
+    The gradients are averaged first, after which the gradient diagnostics (see
+    :func:`get_grads_diagnostics`) are recomputed on the averaged gradients, i.e. these describe
+    the gradients that are actually applied. All other metrics are averaged. Only the floating
+    point leaves of the function state are averaged; other leaves (e.g. step counters) are left
+    as they are.
+
+    This function is to be called inside a function that is mapped by :func:`jax.pmap`.
+
+    Parameters
+    ----------
+    grads : pytree with ndarray leaves
+
+        The per-device gradients.
+
+    function_state : pytree
+
+        The per-device internal state of the forward-pass function.
+
+    metrics : dict of scalar ndarrays
+
+        The per-device metrics.
+
+    axis_name : hashable
+
+        The name of the mapped axis.
+
+    grads_key_prefix : str, optional
+
+        The key prefix of the gradient diagnostics in :code:`metrics`, see
+        :func:`get_grads_diagnostics`.
+
+    Returns
+    -------
+    grads : pytree with ndarray leaves
+
+        The averaged gradients.
+
+    function_state : pytree
+
+        The averaged function state.
+
+    metrics : dict of scalar ndarrays
+
+        The averaged metrics.
+
+    """
+    def pmean(x):
+        return jax.lax.pmean(x, axis_name)
+
+    grads = jax.tree_map(pmean, grads)
+    grads_diagnostics = get_grads_diagnostics(grads, grads_key_prefix)
+    metrics = {k: pmean(v) for k, v in metrics.items() if k not in grads_diagnostics}
+    metrics.update(grads_diagnostics)
+    function_state = jax.tree_map(
+        lambda x: pmean(x) if jnp.issubdtype(x.dtype, jnp.inexact) else x, function_state)
+    return grads, function_state, metrics
+
+
 def _safe_sample(space, rnd):
     if isinstance(space, gym.spaces.Discrete):
         return rnd.randint(space.n)
@@ -860,6 +941,43 @@ def safe_sample(space, seed=None):
     return _safe_sample(space, rnd)
 
 
+def shard_batch(pytree, num_shards):
+    r"""
+
+    Split the leading (batch) axis of all leaves of a pytree into :code:`num_shards` equal shards.
+    This is useful for distributing a batch over multiple devices with :func:`jax.pmap`.
+
+    Parameters
+    ----------
+    pytree : pytree with ndarray leaves
+
+        A pytree of batched arrays, e.g. a :class:`TransitionBatch
+        <coax.reward_tracing.TransitionBatch>`.
+
+    num_shards : positive int
+
+        The number of shards, e.g. :code:`jax.local_device_count()`.
+
+    Returns
+    -------
+    sharded : pytree with ndarray leaves
+
+        The same pytree in which each leaf has shape :code:`[num_shards, batch_size // num_shards,
+        ...]`.
+
+    """
+    leaves = jax.tree_leaves(pytree)
+    batch_size = leaves[0].shape[0] if leaves else 0
+    if not isinstance(num_shards, int) or num_shards < 1:
+        raise ValueError(f"num_shards must be a positive int, got: {num_shards}")
+    if batch_size % num_shards:
+        raise ValueError(
+            f"batch_size must be divisible by num_shards, got: {batch_size} % {num_shards} != 0")
+    return jax.tree_map(
+        lambda leaf: leaf.reshape(num_shards, leaf.shape[0] // num_shards, *leaf.shape[1:]),
+        pytree)
+
+
 def single_to_batch(pytree):
     r"""
 
@@ -904,3 +1022,26 @@ def tree_ravel(pytree):
 
     """
     return jnp.concatenate([jnp.ravel(leaf) for leaf in jax.tree_leaves(pytree)])
+
+
+def unreplicate(pytree):
+    r"""
+
+    Get the data of the first device from the output of a :func:`jax.pmap`-ed function. This is
+    meant for outputs that hold the same values on all devices, e.g. after
+    :func:`pmean_grads_and_metrics`.
+
+    Parameters
+    ----------
+    pytree : pytree with ndarray leaves
+
+        A pytree whose leaves have a leading device axis.
+
+    Returns
+    -------
+    pytree : pytree with ndarray leaves
+
+        The same pytree without the leading device axis.
+
+    """
+    return jax.tree_map(lambda leaf: leaf[0], pytree)
@@ -32,7 +32,12 @@ from ._array import (
     check_preprocessors,
     chunks_pow2,
     default_preprocessor,
+    get_grads_diagnostics,
+    get_magnitude_quantiles,
     get_transition_batch,
+    pmean_grads_and_metrics,
+    shard_batch,
+    tree_ravel,
 )
 
 
@@ -120,3 +125,56 @@ class TestArrayUtils(TestCase):
 
         for chunk, chunk_size in zip(chunks_pow2(tn), chunk_sizes):
             self.assertEqual(chunk.batch_size, chunk_size)
+
+    def test_get_grads_diagnostics(self):
+        rngs = PRNGSequence(13)
+        grads = {
+            'a': jax.random.normal(next(rngs), shape=(3, 5)),
+            'b': {'c': jax.random.normal(next(rngs), shape=(7,))},
+        }
+        flat = tree_ravel(grads)
+        diagnostics = get_grads_diagnostics(grads, key_prefix='grads_')
+        self.assertEqual(set(diagnostics), {'grads_max', 'grads_norm'})
+        self.assertAlmostEqual(diagnostics['grads_max'], jnp.max(jnp.abs(flat)), decimal=5)
+        self.assertAlmostEqual(diagnostics['grads_norm'], jnp.linalg.norm(flat), decimal=5)
+
+    def test_get_magnitude_quantiles(self):
+        rngs = PRNGSequence(13)
+        pytree = {
+            'a': jax.random.normal(next(rngs), shape=(3, 5)),
+            'b': {'c': jax.random.normal(next(rngs), shape=(7,))},
+        }
+        mags = jnp.abs(tree_ravel(pytree))
+        quantiles = get_magnitude_quantiles(pytree, key_prefix='q_')
+        self.assertEqual(list(quantiles), ['q_min', 'q_p25', 'q_p50', 'q_p75', 'q_max'])
+        self.assertAlmostEqual(quantiles['q_min'], jnp.min(mags))
+        self.assertAlmostEqual(quantiles['q_p50'], jnp.median(mags))
+        self.assertAlmostEqual(quantiles['q_max'], jnp.max(mags))
+
+    def test_shard_batch(self):
+        tn = get_transition_batch(self.env_discrete, batch_size=6, random_seed=13)
+        sharded = shard_batch(tn, 3)
+        self.assertEqual(sharded.S.shape, (3, 2) + tn.S.shape[1:])
+        self.assertArrayAlmostEqual(sharded.Rn.reshape(-1), tn.Rn)
+
+        with self.assertRaisesRegex(ValueError, r"batch_size must be divisible by num_shards"):
+            shard_batch(tn, 4)
+
+    def test_pmean_grads_and_metrics(self):
+        rngs = PRNGSequence(13)
+        grads = {'w': jax.random.normal(next(rngs), shape=(2, 3, 5))}  # leading axis: 2 devices
+        state = {'mean': jnp.ones((2, 3)), 'counter': jnp.arange(2)}
+        metrics = {'loss': jnp.array([1., 3.])}
+        metrics.update(jax.vmap(lambda g: get_grads_diagnostics(g, 'grads_'))(grads))
+
+        # collectives over a named vmap axis behave like those over a pmap axis
+        grads_avg, state_avg, metrics_avg = jax.vmap(
+            lambda g, s, m: pmean_grads_and_metrics(g, s, m, 'i', 'grads_'), axis_name='i')(
+                grads, state, metrics)
+
+        expected = jnp.mean(grads['w'], axis=0)
+        self.assertArrayAlmostEqual(grads_avg['w'][0], expected)
+        self.assertAlmostEqual(metrics_avg['loss'][0], 2.)
+        self.assertAlmostEqual(metrics_avg['grads_norm'][0], jnp.linalg.norm(expected), decimal=5)
+        self.assertAlmostEqual(metrics_avg['grads_max'][0], jnp.max(jnp.abs(expected)), decimal=5)
+        self.assertArrayAlmostEqual(state_avg['counter'], jnp.arange(2))  # non-floats untouched
@@ -20,6 +20,7 @@
 # ------------------------------------------------------------------------------------------------ #
 
 
+from functools import partial
 from inspect import signature
 
 import jax
@@ -27,7 +28,10 @@ import jax
 
 __all__ = (
     'JittedFunc',
+    'PmappedFunc',
     'jit',
+    'pmap',
+    'rejit',
 )
 
 
@@ -79,6 +83,9 @@ class JittedFunc:
     def __call__(self, *args, **kwargs):
         return self._jitted_func(*args, **kwargs)
 
+    def lower(self, *args, **kwargs):
+        return self._jitted_func.lower(*args, **kwargs)
+
     @property
     def __signature__(self):
         return signature(self.func)
@@ -98,3 +105,110 @@ class JittedFunc:
             self.func,
             static_argnums=self.static_argnums,
             donate_argnums=self.donate_argnums)
+
+
+def pmap(func, axis_name=None, in_axes=0, static_broadcasted_argnums=()):
+    r"""
+
+    An alternative of :func:`jax.pmap` that returns a picklable parallelized function.
+
+    Like :func:`jit`, this function doesn't allow the user to specify :code:`devices` or
+    :code:`backend`, which means that :func:`jax.pmap` uses all local devices of the default
+    backend.
+
+    Check out the original :func:`jax.pmap` docs for a more detailed description of the arguments.
+
+    Parameters
+    ----------
+    func : function
+
+        Function to be mapped over the leading axis of its inputs.
+
+    axis_name : hashable, optional
+
+        The name of the mapped axis, which is used by collectives like :func:`jax.lax.pmean`.
+
+    in_axes : int, None or tuple, optional
+
+        Which axes of the inputs to map over, see :func:`jax.pmap`. Use :code:`None` for inputs
+        that are to be broadcast to all devices.
+
+    static_broadcasted_argnums : int or tuple of ints
+
+        Arguments to exclude from compilation.
+
+    Returns
+    -------
+    pmapped_func : PmappedFunc
+
+        A picklable parallelized function.
+
+    """
+    return PmappedFunc(func, axis_name, in_axes, static_broadcasted_argnums)
+
+
+class PmappedFunc:
+    __slots__ = (
+        'func', 'axis_name', 'in_axes', 'static_broadcasted_argnums', '_pmapped_func')
+
+    def __init__(self, func, axis_name=None, in_axes=0, static_broadcasted_argnums=()):
+        self.func = func
+        self.axis_name = axis_name
+        self.in_axes = in_axes
+        self.static_broadcasted_argnums = static_broadcasted_argnums
+        self._init_pmapped_func()
+
+    def __call__(self, *args, **kwargs):
+        return self._pmapped_func(*args, **kwargs)
+
+    @property
+    def __signature__(self):
+        return signature(self.func)
+
+    def __repr__(self):
+        return self.__class__.__name__ + str(self.__signature__)
+
+    def __getstate__(self):
+        return self.func, self.axis_name, self.in_axes, self.static_broadcasted_argnums
+
+    def __setstate__(self, state):
+        self.func, self.axis_name, self.in_axes, self.static_broadcasted_argnums = state
+        self._init_pmapped_func()
+
+    def _init_pmapped_func(self):
+        self._pmapped_func = jax.pmap(
+            self.func,
+            axis_name=self.axis_name,
+            in_axes=self.in_axes,
+            static_broadcasted_argnums=self.static_broadcasted_argnums)
+
+
+def rejit(func):
+    r"""
+
+    Create a fresh copy of a function that was compiled with :func:`jit` or :func:`pmap`.
+
+    This is needed whenever a python-level setting that the function reads at trace time has
+    changed. Such settings are baked into the compiled graph, and simply calling the function again
+    would hit jax's tracing cache. The copy wraps the original function in a new
+    :func:`functools.partial`, so that jax sees it as a different function and traces it anew.
+
+    Parameters
+    ----------
+    func : JittedFunc or PmappedFunc
+
+        The compiled function to copy.
+
+    Returns
+    -------
+    func_new : JittedFunc or PmappedFunc
+
+        A copy of :code:`func` with the same compilation settings and an empty tracing cache.
+
+    """
+    if isinstance(func, JittedFunc):
+        return JittedFunc(partial(func.func), func.static_argnums, func.donate_argnums)
+    if isinstance(func, PmappedFunc):
+        return PmappedFunc(
+            partial(func.func), func.axis_name, func.in_axes, func.static_broadcasted_argnums)
+    raise TypeError(f"func must be a JittedFunc or PmappedFunc, got: {type(func)}")
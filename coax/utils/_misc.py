@@ -33,6 +33,7 @@ from PIL import Image
 
 
 __all__ = (
+    'configure_memory',
     'docstring',
     'enable_logging',
     'dump',
@@ -150,6 +151,48 @@ def enable_logging(name=None, level=logging.INFO, output_filepath=None, output_l
         logging.getLogger('').addHandler(fh)
 
 
+def configure_memory(fraction=None, preallocate=None):
+    r"""
+
+    Configure how much accelerator (GPU) memory JAX's XLA client claims for itself.
+
+    By default, XLA preallocates 75% of the total device memory upon its first use. This may
+    compete with other memory consumers in the same process or on the same device, e.g. a large
+    replay buffer that is kept on the device. This function sets the corresponding environment
+    variables:
+
+    .. code:: python
+
+        os.environ['XLA_PYTHON_CLIENT_MEM_FRACTION'] = str(fraction)
+        os.environ['XLA_PYTHON_CLIENT_PREALLOCATE'] = 'true' if preallocate else 'false'
+
+    Note that XLA reads these environment variables only once, namely when the backend is
+    initialized. This means that this function must be called before the first JAX computation (or
+    array creation) takes place. We deliberately don't expose the :code:`'platform'` allocator
+    (:code:`XLA_PYTHON_CLIENT_ALLOCATOR`), because it's much slower than the default allocator.
+
+    Parameters
+    ----------
+    fraction : float in (0, 1], optional
+
+        The fraction of the total device memory that is claimed by XLA, e.g. :code:`fraction=0.5`.
+        If left unspecified, the current setting is left unchanged.
+
+    preallocate : bool, optional
+
+        Whether to allocate the memory fraction upfront. If :code:`preallocate=False`, memory is
+        allocated on demand, in which case :code:`fraction` acts as an upper bound. If left
+        unspecified, the current setting is left unchanged.
+
+    """
+    if fraction is not None:
+        if not 0 < fraction <= 1:
+            raise ValueError(f"fraction must be a float in the interval (0, 1], got: {fraction}")
+        os.environ['XLA_PYTHON_CLIENT_MEM_FRACTION'] = str(float(fraction))
+    if preallocate is not None:
+        os.environ['XLA_PYTHON_CLIENT_PREALLOCATE'] = 'true' if preallocate else 'false'
+
+
 def dump(obj, filepath):
     r"""
 
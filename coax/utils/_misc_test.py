@@ -22,8 +22,10 @@
 import os
 import tempfile
 
+import pytest
+
 from ..utils import jit
-from ._misc import dump, dumps, load, loads
+from ._misc import configure_memory, dump, dumps, load, loads
 
 
 def test_dump_load():
@@ -78,3 +80,26 @@ def test_dumps_loads_jitted_function():
     s = dumps(f)
     f_new = loads(s)
     assert f_new(11) == f(11) == 143
+
+
+def test_configure_memory():
+    keys = ('XLA_PYTHON_CLIENT_MEM_FRACTION', 'XLA_PYTHON_CLIENT_PREALLOCATE')
+    environ_orig = {k: os.environ.get(k) for k in keys}
+    try:
+        configure_memory(fraction=0.5, preallocate=False)
+        assert os.environ['XLA_PYTHON_CLIENT_MEM_FRACTION'] == '0.5'
+        assert os.environ['XLA_PYTHON_CLIENT_PREALLOCATE'] == 'false'
+
+        # unspecified settings are left alone
+        configure_memory(preallocate=True)
+        assert os.environ['XLA_PYTHON_CLIENT_MEM_FRACTION'] == '0.5'
+        assert os.environ['XLA_PYTHON_CLIENT_PREALLOCATE'] == 'true'
+
+        with pytest.raises(ValueError, match=r"fraction must be a float in the interval \(0, 1\]"):
+            configure_memory(fraction=1.5)
+    finally:
+        for k, v in environ_orig.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v